@@ -1,27 +1,43 @@
 from __future__ import annotations
 
 import argparse
+import functools
+import itertools
 import logging
+import os
 import typing
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Literal, Sequence, Tuple, TypedDict
+from typing import List, Literal, Optional, Sequence, Tuple, TypedDict
 
 import configpile as cp
 import numpy as np
 import tybles as tb
 from astropy.io import fits
-from filelock import FileLock
+from numba import njit
 from numpy.typing import NDArray
 from typing_extensions import Annotated
 
-from ..lib.analysis import grouping
 from ..lib.data import LoggingLevel, PathPattern, PickleProtocol
-from ..lib.io import save_pickle
+from ..lib.io import append_to_csv, save_pickle
 from ..lib.math import absurd_minus_99_9
-from ..lib.util import log_task_name_and_time
+from ..lib.util import log_task_name_and_time, prefetch
 from .types import IndividualBasicRow, IndividualImportedRow, PickledIndividualSpectrum
 
+#: CORALIE flux calibration for low flux spectra, calibrated with HD8651 2016-12-16 AND 2013-10-24,
+#: combined with the rescaling to match with HARPS SNR
+_coralie_scale_low: float = 400780143771.18976 / (1.4e10 / 125**2)
+
+#: CORALIE flux rescaling to match with HARPS SNR
+_coralie_scale_high: float = 1.0 / (1.4e10 / 125**2)
+
+#: Parsec in meters
+_parsec_m: float = 3.08567758e16
+
+#: Square of the conversion factor from mas/yr to rad/s
+_masyr_to_radps_sq: float = (2 * np.pi / (360.0 * 1000.0 * 3600.0 * 86400.0 * 365.25)) ** 2
+
 
 @dataclass(frozen=True)
 class Task(cp.Config):
@@ -43,7 +59,7 @@ class Task(cp.Config):
 
     #: Pickle protocol version to use
     pickle_protocol: Annotated[
-        PickleProtocol, cp.Param.store(PickleProtocol.parser(), default_value="3")
+        PickleProtocol, cp.Param.store(PickleProtocol.parser(), default_value="5")
     ]
 
     #: Logging level to use
@@ -109,11 +125,76 @@ class Task(cp.Config):
         Literal["old", "new"], cp.Param.store(cp.Parser.from_choices(["old", "new"]))
     ]
 
+    #: Number of worker processes used to import the spectra
+    #:
+    #: If value 0 is specified, the number of CPUs is used.
+    nthreads: Annotated[int, cp.Param.store(cp.parsers.int_parser, default_value="1")]
+
+
+@njit(cache=True)
+def _find_hole_numba(wave: NDArray[np.float64], flux: NDArray[np.float64]) -> Tuple[float, float]:
+    """
+    Scan for the longest run of more than 1000 zero flux samples, see :func:`find_hole`
+
+    Any such run contains one sample every 1001, so only those samples are probed, and the
+    full run is measured around a probe with zero flux.
+    """
+    min_len = 1001
+    n = flux.shape[0]
+    best_start = 0
+    best_len = 0
+    i = min_len - 1
+    while i < n:
+        if flux[i] == 0:
+            start = i
+            while start > 0 and flux[start - 1] == 0:
+                start -= 1
+            stop = i
+            while stop + 1 < n and flux[stop + 1] == 0:
+                stop += 1
+            if stop - start + 1 > best_len:
+                best_start = start
+                best_len = stop - start + 1
+            i = stop + min_len
+        else:
+            i += min_len
+    if best_len >= min_len:
+        return (wave[best_start], wave[best_start + best_len - 1])
+    return (absurd_minus_99_9, absurd_minus_99_9)
+
+
+@njit(cache=True)
+def _first_last_positive(flux: NDArray[np.float64]) -> Tuple[int, int]:
+    """
+    Returns the indices of the first and last samples with positive flux
+
+    Args:
+        flux: Flux array
+
+    Raises:
+        ValueError: if no sample has positive flux
+
+    Returns:
+        A tuple ``(begin, end)`` of inclusive indices
+    """
+    n = flux.shape[0]
+    begin = 0
+    while begin < n and not flux[begin] > 0:
+        begin += 1
+    if begin == n:
+        raise ValueError("Spectrum has no positive flux")
+    end = n - 1
+    while not flux[end] > 0:
+        end -= 1
+    return (begin, end)
+
 
 def find_hole(wave: NDArray[np.float64], flux: NDArray[np.float64]) -> Tuple[float, float]:
     """
     Finds a gap between CCD
 
+    The gap is the longest run of more than 1000 consecutive samples with zero flux.
+
     Args:
         wave: Wavelength array
         flux: Flux array
@@ -121,16 +202,7 @@ def find_hole(wave: NDArray[np.float64], flux: NDArray[np.float64]) -> Tuple[flo
     Returns:
         The endpoints of the wavelength interval if the gap, or (-99.9, -99.9) if not found
     """
-    null_flux = np.where(flux == 0)[0]  # criterion to detect gap between ccd
-    left = absurd_minus_99_9
-    right = absurd_minus_99_9
-    if len(null_flux) > 0:
-        mask = grouping(np.diff(null_flux), 0.5, 0)[-1]
-        highest = mask[mask[:, 2].argmax()]
-        if highest[2] > 1000:
-            left = wave[int(null_flux[highest[0]])]  # store left or -99
-            right = wave[int(null_flux[highest[1]])]  # store right or -99
-    return (left, right)
+    return _find_hole_numba(wave, flux)
 
 
 def preprocess_import(
@@ -143,55 +215,53 @@ def preprocess_import(
 ) -> Tuple[PickledIndividualSpectrum, IndividualImportedRow]:
 
     if drs_style == "old":
-        spectre = data.astype("float64")  # the flux of your spectrum
+        spectre = np.asarray(data, dtype=np.float64)  # the flux of your spectrum
         spectre_step = np.round(header["CDELT1"], 8)
-        spectre_error = np.zeros(len(spectre))
         wave_min = np.round(header["CRVAL1"], 8)  # to round float32
-        wave_max = np.round(
-            header["CRVAL1"] + (len(spectre) - 1) * spectre_step, 8
-        )  # to round float32
-        wave = np.round(np.linspace(wave_min, wave_max, len(spectre)), 8)
 
         # cut left and right parts with zero flux
         # and reevaluate wave_min and wave_max
 
         # should this be done outside?
-        begin = np.min(np.arange(len(spectre))[spectre > 0])
-        end = np.max(np.arange(len(spectre))[spectre > 0])
-        wave = wave[begin : end + 1]
+        begin, end = _first_last_positive(spectre)
         spectre = spectre[begin : end + 1]
+        spectre_error: Optional[NDArray[np.float64]] = None  # not provided by the old DRS
+        # only the kept part of the equidistant grid is materialized, in a single buffer
+        wave = np.arange(begin, end + 1, dtype=np.float64)
+        wave *= spectre_step
+        wave += wave_min
+        np.round(wave, 8, out=wave)
+        wave_min = wave[0]
+        wave_max = wave[-1]
         kw = "ESO"
         if instrument == "HARPN":
             kw = "TNG"
         berv = np.float64(header[f"HIERARCH {kw} DRS BERV"])
         lamp = np.float64(header[f"HIERARCH {kw} DRS CAL TH LAMP OFFSET"])
     else:
-        spectre = data["flux"].astype("float64")  # the flux of your spectrum
-        spectre_error = data["error"].astype("float64")  # the flux of your spectrum
+        spectre = np.asarray(data["flux"], dtype=np.float64)  # the flux of your spectrum
+        spectre_error = np.asarray(data["error"], dtype=np.float64)  # the flux of your spectrum
         # wave was grid in the previous code
-        wave = data["wavelength_air"].astype(
-            "float64"
+        wave = np.asarray(
+            data["wavelength_air"], dtype=np.float64
         )  # the grid of wavelength of your spectrum (assumed equidistant in lambda)
-        begin = np.min(np.arange(len(spectre))[spectre > 0])  # remove border spectrum with 0 value
-        end = np.max(np.arange(len(spectre))[spectre > 0])  # remove border spectrum with 0 value
+        begin, end = _first_last_positive(spectre)  # remove border spectrum with 0 value
         wave = wave[begin : end + 1]
         spectre = spectre[begin : end + 1]
         spectre_error = spectre_error[begin : end + 1]
-        spectre_step = np.mean(np.diff(wave))
+        spectre_step = (wave[-1] - wave[0]) / (len(wave) - 1)  # equals np.mean(np.diff(wave))
+        wave_min = np.min(wave)
+        wave_max = np.max(wave)
         kw = "ESO"
         if "HIERARCH TNG QC BERV" in header:
             kw = "TNG"
         berv = np.float64(header["HIERARCH " + kw + " QC BERV"])
         lamp = np.float64(0.0)  # header['HIERARCH ESO DRS CAL TH LAMP OFFSET'] no yet available
 
-    wave_min = np.min(wave)
-    wave_max = np.max(wave)
-
     if instrument == "CORALIE":
-        if np.mean(spectre) < 100000:
-            spectre *= 400780143771.18976  # calibrated with HD8651 2016-12-16 AND 2013-10-24
-
-        spectre /= 1.4e10 / 125**2  # calibrated to match with HARPS SNR
+        scale = _coralie_scale_low if np.mean(spectre) < 100000 else _coralie_scale_high
+        # not in place, spectre may be a view of the caller's data
+        spectre = spectre * scale
 
     mjd = row.mjd
 
@@ -203,14 +273,13 @@ def preprocess_import(
         pmd = np.float64(header[f"HIERARCH {kw} TEL TARG PMD"] * 1000)
 
     if plx_mas:
-        distance_m = 1000.0 / plx_mas * 3.08567758e16
-        mu_radps = (
-            np.sqrt(pma**2 + pmd**2) * 2 * np.pi / (360.0 * 1000.0 * 3600.0 * 86400.0 * 365.25)
-        )
-        acc_sec = distance_m * 86400.0 * mu_radps**2  # rv secular drift in m/s per days
+        distance_m = 1000.0 / plx_mas * _parsec_m
+        mu_radps_sq = (pma**2 + pmd**2) * _masyr_to_radps_sq
+        acc_sec = distance_m * 86400.0 * mu_radps_sq  # rv secular drift in m/s per days
     else:
-        acc_sec = 0.0
+        acc_sec = np.float64(0.0)
     jdb = np.float64(mjd) + 0.5
+    plx = np.float64(plx_mas)
 
     hole_left, hole_right = find_hole(wave, spectre)
     if hole_left != absurd_minus_99_9 and hole_right != absurd_minus_99_9:
@@ -222,11 +291,11 @@ def preprocess_import(
         "flux_err": spectre_error,
         "instrument": instrument,
         "mjd": mjd,
-        "jdb": np.float64(jdb),
-        "berv": np.float64(berv),
-        "lamp_offset": np.float64(lamp),
-        "plx_mas": np.float64(plx_mas),
-        "acc_sec": np.float64(acc_sec),
+        "jdb": jdb,
+        "berv": berv,
+        "lamp_offset": lamp,
+        "plx_mas": plx,
+        "acc_sec": acc_sec,
         "wave_min": wave_min,
         "wave_max": wave_max,
         "dwave": spectre_step,
@@ -242,8 +311,8 @@ def preprocess_import(
         jdb=jdb,
         berv=berv,
         lamp_offset=lamp,
-        plx_mas=np.float64(plx_mas),
-        acc_sec=np.float64(acc_sec),
+        plx_mas=plx,
+        acc_sec=acc_sec,
         wave_min=wave_min,
         wave_max=wave_max,
         dwave=spectre_step,
@@ -261,6 +330,87 @@ def get_parser() -> argparse.ArgumentParser:
     return Task.get_argument_parser_()
 
 
+def _read_fits(filename: Path, memmap: bool = True) -> Tuple[fits.Header, np.ndarray]:
+    """
+    Reads the primary header and the spectrum data of a FITS file in a single open
+
+    As with :func:`astropy.io.fits.getdata`, the data is taken from the primary HDU, or from the
+    first extension when the primary HDU is empty (new DRS binary tables).
+
+    Image data is read without BSCALE/BZERO scaling when those are trivial, which is the case of
+    the s1d files of the old DRS; otherwise the file is reopened to let Astropy scale it.
+
+    Args:
+        filename: FITS file to read
+        memmap: Whether to memory-map the data, or to read it in memory
+
+    Returns:
+        A tuple ``(header, data)``
+    """
+    with fits.open(filename, memmap=memmap, do_not_scale_image_data=True) as hdul:
+        header = hdul[0].header
+        if header.get("BSCALE", 1) == 1 and header.get("BZERO", 0) == 0:
+            data = hdul[0].data
+            if data is None:
+                data = hdul[1].data
+            return header, data
+    with fits.open(filename, memmap=memmap) as hdul:
+        header = hdul[0].header
+        data = hdul[0].data
+        if data is None:
+            data = hdul[1].data
+    return header, data
+
+
+def _init_worker(t: Task) -> None:
+    """Applies the process-wide settings of the task in a worker process"""
+    t.logging_level.set()
+    t.pickle_protocol.set()
+
+
+def _import_one(
+    t: Task, row: IndividualBasicRow, header: fits.Header, data: np.ndarray
+) -> IndividualImportedRow:
+    """
+    Imports a single spectrum read from its FITS file and writes its pickle
+
+    Args:
+        t: Task configuration
+        row: Row of the input table describing the spectrum
+        header: Primary header of the FITS file
+        data: Spectrum data of the FITS file
+
+    Returns:
+        The row to append to the output table
+    """
+    output_filename = t.output_pattern.to_path(t.root, row.name)
+    output_pickle, output_row = preprocess_import(
+        row=row,
+        header=header,
+        data=data,
+        instrument=t.instrument,
+        plx_mas=t.plx_mas,
+        drs_style=t.drs_style,
+    )
+    save_pickle(output_filename, output_pickle)
+    return output_row
+
+
+def _process_one(t: Task, row: IndividualBasicRow) -> IndividualImportedRow:
+    """
+    Reads and imports a single spectrum, and writes its pickle
+
+    Args:
+        t: Task configuration
+        row: Row of the input table describing the spectrum
+
+    Returns:
+        The row to append to the output table
+    """
+    header, data = _read_fits(t.root / t.input_folder / row.raw_filename)
+    return _import_one(t, row, header, data)
+
+
 @log_task_name_and_time(name="preprocess_import")
 def run(t: Task) -> None:
     t.logging_level.set()
@@ -270,31 +420,23 @@ def run(t: Task) -> None:
 
     if not inputs:
         inputs = list(range(len(tyble)))
-    rows1: List[IndividualImportedRow] = []
-    for i in inputs:
-        row = tyble[i]
-        input_filename = t.root / t.input_folder / row.raw_filename
-        output_filename = t.output_pattern.to_path(t.root, row.name)
-        data = fits.getdata(input_filename)
-        header = fits.getheader(input_filename)
-        output_pickle, output_row = preprocess_import(
-            row=row,
-            header=header,
-            data=data,
-            instrument=t.instrument,
-            plx_mas=t.plx_mas,
-            drs_style=t.drs_style,
-        )
-        rows1.append(output_row)
-        save_pickle(output_filename, output_pickle)
-
-    output_table = t.root / t.output_table
-    output_table_lockfile = output_table.with_suffix(output_table.suffix + ".lock")
-
-    logging.debug(f"Appending to output table {output_table}")
-    with FileLock(output_table_lockfile):
-        df = IndividualImportedRow.schema().from_rows(rows1, return_type="DataFrame")
-        df.to_csv(output_table, header=not output_table.exists(), mode="a", index=False)
+    rows = [tyble[i] for i in inputs]
+    rows1: List[IndividualImportedRow]
+    if t.nthreads == 1:
+        # the next FITS files are read in the background while the current one is processed
+        input_filenames = [t.root / t.input_folder / row.raw_filename for row in rows]
+        fits_contents = prefetch(functools.partial(_read_fits, memmap=False), input_filenames)
+        rows1 = [
+            _import_one(t, row, header, data) for row, (header, data) in zip(rows, fits_contents)
+        ]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=t.nthreads or os.cpu_count(), initializer=_init_worker, initargs=(t,)
+        ) as executor:
+            rows1 = list(executor.map(_process_one, itertools.repeat(t), rows))
+
+    df = IndividualImportedRow.schema().from_rows(rows1, return_type="DataFrame")
+    append_to_csv(t.root / t.output_table, df)
 
 
 def cli() -> None:
@@ -11,14 +11,13 @@ import configpile as cp
 import numpy as np
 import numpy.typing as npt
 import tybles as tb
-from filelock import FileLock
 from numpy.typing import NDArray
 from scipy.interpolate import interp1d
 from typing_extensions import Annotated
 
 from ..lib.analysis import find_nearest1
 from ..lib.data import LoggingLevel, PickleProtocol
-from ..lib.io import open_pickle, save_pickle
+from ..lib.io import append_to_csv, open_pickle, save_pickle
 from ..lib.math import absurd_minus_99_9, create_grid, doppler_r
 from ..lib.util import log_task_name_and_time
 from .types import (
@@ -179,20 +178,25 @@ def reinterpolate(
 
     # reinterpolated using static_grid
     static_grid = s.static_grid
+    shifted_wave = doppler_r(wave, row.rv_shift)[1]
     new_flux = interp1d(
-        doppler_r(wave, row.rv_shift)[1],
+        shifted_wave,
         flux,
         kind="cubic",
         bounds_error=False,
         fill_value="extrapolate",
     )(static_grid)
-    new_flux_err = interp1d(
-        doppler_r(wave, row.rv_shift)[1],
-        flux_err,
-        kind="linear",
-        bounds_error=False,
-        fill_value="extrapolate",
-    )(static_grid)
+    if flux_err is None:
+        # no error provided, the interpolation of zeros is zero
+        new_flux_err = np.zeros(len(static_grid))
+    else:
+        new_flux_err = interp1d(
+            shifted_wave,
+            flux_err,
+            kind="linear",
+            bounds_error=False,
+            fill_value="extrapolate",
+        )(static_grid)
 
     mask2 = (static_grid >= (s.hole_left_k - s.dlambda / 2.0)) & (
         static_grid <= (s.hole_right_k + s.dlambda / 2.0)
@@ -282,13 +286,8 @@ def run(t: Task) -> None:
         r = tyble[i]
         output_rows.append(reinterpolate(t, r, settings))
 
-    output_table = t.root / t.output_table
-    output_table_lockfile = output_table.with_suffix(output_table.suffix + ".lock")
-
-    logging.debug(f"Appending to output table {output_table}")
-    with FileLock(output_table_lockfile):
-        df = IndividualReinterpolatedRow.schema().from_rows(output_rows, return_type="DataFrame")
-        df.to_csv(output_table, header=not output_table.exists(), mode="a", index=False)
+    df = IndividualReinterpolatedRow.schema().from_rows(output_rows, return_type="DataFrame")
+    append_to_csv(t.root / t.output_table, df)
 
 
 def cli() -> None:
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+import functools
 from dataclasses import dataclass
-from typing import TypedDict
+from typing import Optional, TypedDict
 
 import numpy as np
 import tybles as tb
@@ -22,6 +23,7 @@ class DACE:
     model: np.float64
 
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def schema() -> tb.Schema[DACE]:
         return tb.schema(DACE, order_columns=True, missing_columns="error", extra_columns="drop")
 
@@ -67,6 +69,7 @@ class IndividualBasicRow:
     drift: np.float64
 
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def schema() -> tb.Schema[IndividualBasicRow]:
         return tb.schema(
             IndividualBasicRow, order_columns=True, missing_columns="error", extra_columns="drop"
@@ -140,6 +143,7 @@ class IndividualReinterpolatedRow:
     drift: np.float64
 
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def schema() -> tb.Schema[IndividualReinterpolatedRow]:
         return tb.schema(
             IndividualReinterpolatedRow,
@@ -202,8 +206,8 @@ class PickledIndividualSpectrum(TypedDict):
     #: Flux in photon count units, must not have NaNs
     flux: NDArray[np.float64]
 
-    #: Error on flux, must not have NaNs
-    flux_err: NDArray[np.float64]
+    #: Error on flux, must not have NaNs, or None if the DRS does not provide it
+    flux_err: Optional[NDArray[np.float64]]
 
     #: Instrument name
     instrument: str
@@ -295,6 +299,7 @@ class IndividualImportedRow:
     drift: np.float64
 
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def schema() -> tb.Schema[IndividualImportedRow]:
         return tb.schema(
             IndividualImportedRow,
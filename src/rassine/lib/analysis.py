@@ -12,17 +12,10 @@ def grouping(
     cluster = difference < threshold
     indices = np.arange(len(cluster))[cluster]
 
-    j = 0
-    border_left = [indices[0]]
-    border_right = []
-    while j < len(indices) - 1:
-        if indices[j] == indices[j + 1] - 1:
-            j += 1
-        else:
-            border_right.append(indices[j])
-            border_left.append(indices[j + 1])
-            j += 1
-    border_right.append(indices[-1])
+    # runs of consecutive indices are delimited where the indices jump by more than one
+    breaks = np.nonzero(np.diff(indices) != 1)[0]
+    border_left = np.r_[indices[0], indices[breaks + 1]]
+    border_right = np.r_[indices[breaks], indices[-1]]
     border = np.array([border_left, border_right]).T
     border = np.hstack([border, (1 + border[:, 1] - border[:, 0])[:, np.newaxis]])
 
@@ -2,11 +2,12 @@ import logging
 import pickle
 from enum import Enum
 from pathlib import Path
-from typing import Any, Dict, Type, TypeVar, Union, overload
+from typing import Any, Dict, Optional, Type, TypeVar, Union, overload
 
 import numpy.typing as npt
 import pandas as pd
 from astropy.io import fits
+from filelock import FileLock
 
 default_pickle_protocol: int = 3
 
@@ -51,15 +52,40 @@ def open_pickle(filename: Path, expected_type: Any = NoCheck.TOKEN) -> Any:
     return res
 
 
-def save_pickle(filename: Path, output: Any, protocol: int = default_pickle_protocol):
+def save_pickle(filename: Path, output: Any, protocol: Optional[int] = None):
     """
     Save a pickle file with the proper protocol pickle version.
 
     Args:
         filename: Name of the output pickle file.
         output: Data to save
-        protocol:
+        protocol: Pickle protocol version, defaults to the level set by the current task
     """
     logging.debug("Writing pickle %s", filename)
-    with open(filename, "wb") as f:
+    if protocol is None:
+        protocol = default_pickle_protocol
+    # a large buffer batches the small pickle opcodes into few write calls
+    with open(filename, "wb", buffering=1 << 20) as f:
         pickle.dump(output, f, protocol=protocol)
+
+
+def append_to_csv(filename: Path, df: pd.DataFrame) -> None:
+    """
+    Appends the rows of a dataframe to a CSV file, writing the header if the file is new
+
+    The CSV text is produced before acquiring the lock on the file, so that concurrent
+    invocations only hold the lock for the write itself.
+
+    Args:
+        filename: CSV file to append to
+        df: Rows to append
+    """
+    header = df.iloc[:0].to_csv(index=False)
+    body = df.to_csv(header=False, index=False)
+    logging.debug("Appending to output table %s", filename)
+    with FileLock(filename.with_suffix(filename.suffix + ".lock")):
+        write_header = not filename.exists()
+        with open(filename, "a", newline="") as f:
+            if write_header:
+                f.write(header)
+            f.write(body)
@@ -1,11 +1,16 @@
+import collections
 import functools
 import logging
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Callable, TypeVar, cast
+from typing import Any, Callable, Deque, Iterable, Iterator, TypeVar, cast
 
 _Fun = TypeVar("_Fun", bound=Callable[..., Any])
 
+_A = TypeVar("_A")
+_B = TypeVar("_B")
+
 
 @dataclass(frozen=True)
 class log_task_name_and_time:
@@ -23,3 +28,28 @@ class log_task_name_and_time:
             return value
 
         return cast(_Fun, wrapped)
+
+
+def prefetch(f: Callable[[_A], _B], items: Iterable[_A], depth: int = 2) -> Iterator[_B]:
+    """
+    Maps a function over items in a background thread, computing a few results in advance
+
+    This overlaps I/O with computation: while the caller processes a result, the next ones are
+    being computed.
+
+    Args:
+        f: Function to apply
+        items: Arguments to apply the function to
+        depth: Maximal number of results computed in advance
+
+    Yields:
+        The results of ``f``, in the order of ``items``
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending: Deque[Future[_B]] = collections.deque()
+        for item in items:
+            pending.append(executor.submit(f, item))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
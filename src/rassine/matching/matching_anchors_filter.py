@@ -12,11 +12,10 @@ from typing import Any, List, Optional, Sequence, Union, cast
 
 import configpile as cp
 import numpy as np
-from filelock import FileLock
 from typing_extensions import Annotated
 
 from ..lib.data import LoggingLevel, NameRow, PathPattern, PickleProtocol
-from ..lib.io import open_pickle, save_pickle
+from ..lib.io import append_to_csv, open_pickle, save_pickle
 from ..lib.math import local_max, make_continuum
 from ..lib.util import log_task_name_and_time
 from ..rassine.types import RassinePickle
@@ -437,14 +436,8 @@ def run(t: Task) -> None:
                 diagnostic_rows.append(res)
 
     if t.output_table is not None:
-        output_table_path = t.root / t.output_table
-        output_table_lockfile = output_table_path.with_suffix(output_table_path.suffix + ".lock")
-        logging.debug("Appending to output table %s", t.output_table)
-        with FileLock(output_table_lockfile):
-            df = MatchingAnchorsRow.schema().from_rows(diagnostic_rows, return_type="DataFrame")
-            df.to_csv(
-                output_table_path, header=not output_table_path.exists(), mode="a", index=False
-            )
+        df = MatchingAnchorsRow.schema().from_rows(diagnostic_rows, return_type="DataFrame")
+        append_to_csv(t.root / t.output_table, df)
 
 
 def cli():
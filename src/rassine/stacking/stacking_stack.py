@@ -12,14 +12,13 @@ import numpy as np
 import numpy.typing as npt
 import tybles as tb
 from astropy.time import Time
-from filelock import FileLock
 from numpy.typing import ArrayLike, NDArray
 from typing_extensions import Annotated
 
 from ..imports.reinterpolate import IndividualReinterpolatedRow, ReinterpolatedSpectrumPickle
 from ..lib.analysis import find_nearest1
 from ..lib.data import LoggingLevel, PickleProtocol
-from ..lib.io import open_pickle, save_pickle
+from ..lib.io import append_to_csv, open_pickle, save_pickle
 from ..lib.math import create_grid
 from ..lib.util import log_task_name_and_time
 from .types import IndividualGroupRow, StackedBasicRow, StackedPickle
@@ -268,13 +267,8 @@ def run(t: Task) -> None:
         assert rows, "A group must have at least one spectrum in it"
         stacked_rows.append(perform_stacking(t, rows, group, bin_length, dbin))
 
-    output_table = t.root / t.output_table
-    output_table_lockfile = output_table.with_suffix(output_table.suffix + ".lock")
-
-    logging.debug("Appending to output table %s", output_table)
-    with FileLock(output_table_lockfile):
-        df = StackedBasicRow.schema().from_rows(stacked_rows, return_type="DataFrame")
-        df.to_csv(output_table, header=not output_table.exists(), mode="a", index=False)
+    df = StackedBasicRow.schema().from_rows(stacked_rows, return_type="DataFrame")
+    append_to_csv(t.root / t.output_table, df)
 
 
 def cli() -> None:
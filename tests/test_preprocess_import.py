@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from rassine.imports.preprocess_import import preprocess_import
+from rassine.imports.types import IndividualBasicRow
+
+
+def make_row() -> IndividualBasicRow:
+    return IndividualBasicRow(
+        name="spectrum",
+        raw_filename="spectrum.fits",
+        mjd=np.float64(56000.0),
+        model=np.float64(0.0),
+        rv_mean=np.float64(0.0),
+        rv_shift=np.float64(0.0),
+        vrad=np.float64(0.0),
+        svrad=np.float64(0.0),
+        drift=np.float64(0.0),
+    )
+
+
+def make_flux(n: int = 10000) -> np.ndarray:
+    """Flux with zero borders of 10 and 20 samples, and a CCD gap of 1500 samples"""
+    flux = np.full(n, 1000.0)
+    flux[:10] = 0.0
+    flux[-20:] = 0.0
+    flux[4000:5500] = 0.0
+    return flux
+
+
+def test_preprocess_import_old_drs() -> None:
+    flux = make_flux()
+    header = fits.Header()
+    header["CRVAL1"] = 4000.0
+    header["CDELT1"] = 0.01
+    header["HIERARCH ESO DRS BERV"] = 1.5
+    header["HIERARCH ESO DRS CAL TH LAMP OFFSET"] = 0.2
+    output_pickle, output_row = preprocess_import(
+        row=make_row(),
+        header=header,
+        data=flux.astype(np.float32),
+        instrument="HARPS",
+        plx_mas=0.0,
+        drs_style="old",
+    )
+    assert len(output_pickle["flux"]) == len(flux) - 30
+    assert len(output_pickle["wave"]) == len(output_pickle["flux"])
+    assert output_pickle["flux_err"] is None
+    assert output_pickle["wave_min"] == pytest.approx(4000.1)
+    assert output_pickle["wave_max"] == pytest.approx(4000.0 + 9979 * 0.01)
+    assert output_row.berv == 1.5
+    assert output_row.hole_left == pytest.approx(4040.0)
+    assert output_row.hole_right == pytest.approx(4054.99)
+
+
+def test_preprocess_import_coralie_keeps_input() -> None:
+    flux = make_flux()
+    data = flux.copy()
+    header = fits.Header()
+    header["CRVAL1"] = 4000.0
+    header["CDELT1"] = 0.01
+    header["HIERARCH ESO DRS BERV"] = 1.5
+    header["HIERARCH ESO DRS CAL TH LAMP OFFSET"] = 0.2
+    output_pickle, _ = preprocess_import(
+        row=make_row(),
+        header=header,
+        data=data,
+        instrument="CORALIE",
+        plx_mas=0.0,
+        drs_style="old",
+    )
+    np.testing.assert_array_equal(data, flux)
+    assert output_pickle["flux"][0] != flux[10]
+
+
+def test_preprocess_import_new_drs() -> None:
+    flux = make_flux()
+    data = np.zeros(
+        len(flux), dtype=[("wavelength_air", ">f8"), ("flux", ">f8"), ("error", ">f8")]
+    )
+    data["wavelength_air"] = 5000.0 + 0.01 * np.arange(len(flux))
+    data["flux"] = flux
+    data["error"] = 1.0
+    header = fits.Header()
+    header["HIERARCH ESO QC BERV"] = -2.0
+    output_pickle, output_row = preprocess_import(
+        row=make_row(),
+        header=header,
+        data=data,
+        instrument="ESPRESSO",
+        plx_mas=0.0,
+        drs_style="new",
+    )
+    assert len(output_pickle["flux"]) == len(flux) - 30
+    assert output_pickle["flux_err"] is not None
+    assert len(output_pickle["flux_err"]) == len(output_pickle["flux"])
+    assert output_pickle["dwave"] == pytest.approx(0.01)
+    assert output_row.berv == -2.0
+    assert output_row.lamp_offset == 0.0
+    assert output_row.hole_left == pytest.approx(5040.0)
+    assert output_row.hole_right == pytest.approx(5054.99)